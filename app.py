@@ -10,26 +10,158 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import os
+import time
+import asyncio
+import contextlib
+import sqlite3
+import hashlib
+from collections import deque, OrderedDict
 
 # ========= Required for real-time prediction =========
 import httpx
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from sklearn.neighbors import BallTree
 # =====================================================
 
 app = FastAPI(title="AQI Predictor Pro", description="Advanced Air Quality Analysis by Challa Rakesh Reddy")
 
 # Global variables for model and dataset
 model = None
+model_version = None
 df = None
 
+# Spatial index over station coordinates (built once the dataset is loaded)
+EARTH_RADIUS_KM = 6371.0
+MAX_STATION_DISTANCE_KM = 300.0
+station_tree = None
+stations = None
+
+# Live weather/pollution inputs cached per station, keyed by rounded (lat, lng); LRU-bounded, expired entries evicted
+LIVE_CACHE_TTL_SECONDS = 600
+LIVE_CACHE_MAX_ENTRIES = 1024
+live_cache = OrderedDict()
+
+def build_station_index(data):
+    """Build a haversine BallTree over the unique station coordinates in the dataset"""
+    data.columns = data.columns.str.strip()
+    # Every distinct coordinate is a station, so same-named cities and multi-station cities all stay in the tree
+    unique_stations = data[['City', 'State', 'lat', 'lng']].dropna(subset=['lat', 'lng']).drop_duplicates(subset=['lat', 'lng']).reset_index(drop=True)
+    tree = BallTree(np.radians(unique_stations[['lat', 'lng']].to_numpy(dtype=float)), metric='haversine')
+    return tree, unique_stations
+
+# Prediction log: bounded in-memory ring buffer, flushed in batches to SQLite (WAL) by a background task
+PREDICTION_LOG_DB = 'prediction_log.db'
+PREDICTION_LOG_MAX_BUFFER = 10000
+PREDICTION_LOG_FLUSH_SECONDS = 2.0
+prediction_log = deque(maxlen=PREDICTION_LOG_MAX_BUFFER)
+prediction_log_dropped = 0  # records lost to buffer overflow or failed writes
+prediction_log_conn = None
+prediction_log_task = None
+prediction_log_stop = None
+
+def log_prediction(endpoint, lat, lng, features, predicted_aqi, latency_ms):
+    """Queue a prediction record; never blocks the request, the oldest record is dropped when the buffer is full"""
+    global prediction_log_dropped
+    if len(prediction_log) == prediction_log.maxlen:
+        prediction_log_dropped += 1
+    prediction_log.append((time.time(), endpoint, lat, lng, features, model_version, predicted_aqi, latency_ms))
+
+def open_prediction_log(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS predictions (
+        ts REAL, endpoint TEXT, lat REAL, lng REAL, features TEXT,
+        model_version TEXT, predicted_aqi INTEGER, latency_ms REAL)""")
+    conn.commit()
+    return conn
+
+def write_prediction_batch(conn, batch):
+    # Features are serialised here, on the writer thread, to keep the request path to a deque append
+    rows = [(ts, endpoint, lat, lng, json.dumps(features), version, aqi, latency) for ts, endpoint, lat, lng, features, version, aqi, latency in batch]
+    with conn:
+        conn.executemany("INSERT INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+async def flush_prediction_log():
+    """Drain the buffer and append it to the store in one transaction off the event loop"""
+    global prediction_log_dropped
+    if prediction_log_conn is None or not prediction_log:
+        return
+    batch = [prediction_log.popleft() for _ in range(len(prediction_log))]
+    try:
+        await asyncio.to_thread(write_prediction_batch, prediction_log_conn, batch)
+    except Exception as e:
+        prediction_log_dropped += len(batch)
+        print(f"❌ Error writing prediction log batch of {len(batch)}: {e}")
+
+async def prediction_log_writer():
+    """Flush periodically until asked to stop; a batch already being written always completes"""
+    while not prediction_log_stop.is_set():
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(prediction_log_stop.wait(), timeout=PREDICTION_LOG_FLUSH_SECONDS)
+        await flush_prediction_log()
+
+# Time-sorted, city/state-partitioned series for /api/timeseries
+TIMESERIES_METRICS = ['AQI', 'PM2.5', 'PM10', 'NO2', 'SO2', 'O3', 'CO', 'NH3']
+TIMESERIES_MAX_WIDTH = 1500
+DATASET_TIMEZONE = 'Asia/Kolkata'  # dataset timestamps are naive local (IST) times
+timeseries_index = None
+
+def build_timeseries_index(data):
+    """Partition the dataset by (city, state) and by state into time-sorted numpy series (epoch seconds + one array per metric)"""
+    data.columns = data.columns.str.strip()
+    time_col = 'Datetime' if 'Datetime' in data.columns else 'Date'
+    metrics = [m for m in TIMESERIES_METRICS if m in data.columns]
+    frame = data[['City', 'State'] + metrics].assign(_t=pd.to_datetime(data[time_col], errors='coerce')).dropna(subset=['_t'])
+
+    index = {'city': {}, 'state': {}}
+    for level, cols in (('city', ['City', 'State']), ('state', ['State'])):
+        # Cities are keyed with their state so same-named cities in different states stay separate;
+        # averaging per timestamp merges duplicate rows and rolls cities up into their state
+        grouped = frame.groupby(cols + ['_t'], sort=True)[metrics].mean()
+        for key, part in grouped.groupby(level=cols):
+            name = key if len(cols) > 1 else key[0]
+            t = part.index.get_level_values('_t').values.astype('datetime64[s]').astype(np.int64)
+            index[level][name] = (t, {m: part[m].to_numpy(dtype=np.float64) for m in metrics})
+    return index
+
+def parse_timeseries_bound(value):
+    """Parse a start/end bound to the index's epoch seconds, converting timezone-aware input to naive dataset-local time"""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(DATASET_TIMEZONE).tz_localize(None)
+    return ts.timestamp()
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of a sorted series to at most `threshold` points"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    xf = x.astype(np.float64)
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Next bucket's average is the third vertex (the last point for the final bucket)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = xf[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((xf[a] - avg_x) * (y[lo:hi] - y[a]) - (xf[a] - xf[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
 # Load model and dataset on startup
 @app.on_event("startup")
 async def load_model_and_data():
-    global model, df
+    global model, model_version, df
     try:
         with open('air_quality_model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        print("✅ ML Model loaded successfully!")
+            model_bytes = f.read()
+        model = pickle.loads(model_bytes)
+        model_version = hashlib.sha256(model_bytes).hexdigest()[:12]
+        print(f"✅ ML Model loaded successfully! (version {model_version})")
     except Exception as e:
         print(f"❌ Error loading model: {e}")
         model = None
@@ -57,6 +189,51 @@ async def load_model_and_data():
         print(f"❌ Final error loading dataset: {e}")
         df = None
 
+    global station_tree, stations
+    if df is not None:
+        try:
+            station_tree, stations = build_station_index(df)
+            print(f"✅ Spatial index built over {len(stations)} stations!")
+        except Exception as e:
+            print(f"❌ Error building spatial index: {e}")
+            station_tree, stations = None, None
+
+    global timeseries_index
+    if df is not None:
+        try:
+            timeseries_index = build_timeseries_index(df)
+            print(f"✅ Time-series index built for {len(timeseries_index['city'])} cities!")
+        except Exception as e:
+            print(f"❌ Error building time-series index: {e}")
+            timeseries_index = None
+
+@app.on_event("startup")
+async def start_prediction_log():
+    global prediction_log_conn, prediction_log_task, prediction_log_stop
+    try:
+        prediction_log_conn = open_prediction_log(PREDICTION_LOG_DB)
+        prediction_log_stop = asyncio.Event()
+        prediction_log_task = asyncio.create_task(prediction_log_writer())
+        print(f"✅ Prediction log writing to {PREDICTION_LOG_DB}")
+    except Exception as e:
+        print(f"❌ Error opening prediction log: {e}")
+        prediction_log_conn = None
+
+@app.on_event("shutdown")
+async def stop_prediction_log():
+    global prediction_log_conn
+    if prediction_log_task is not None:
+        # Let the writer finish any in-flight batch before the final drain and close
+        prediction_log_stop.set()
+        with contextlib.suppress(asyncio.CancelledError):
+            await prediction_log_task
+    await flush_prediction_log()
+    if prediction_log_conn is not None:
+        prediction_log_conn.close()
+        prediction_log_conn = None
+    if prediction_log_dropped:
+        print(f"⚠️ Prediction log dropped {prediction_log_dropped} records (buffer overflow or failed writes)")
+
 @app.get("/profile-pic")
 async def get_profile_pic():
     """Save profile picture"""
@@ -618,35 +795,81 @@ async def get_cities():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not retrieve city list: {e}")
 
+class LocationData(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
+    k: int = Field(3, ge=1, le=10)
+
+async def fetch_live_inputs(client, lat, lng):
+    """Fetch current weather and pollution for a coordinate, reusing cached values within the TTL"""
+    key = (round(lat, 4), round(lng, 4))
+    cached = live_cache.get(key)
+    if cached and time.monotonic() - cached[0] < LIVE_CACHE_TTL_SECONDS:
+        live_cache.move_to_end(key)
+        return cached[1], cached[2]
+    live_cache.pop(key, None)
+
+    weather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lng}&appid={OPENWEATHER_API_KEY}&units=metric"
+    w_res = await client.get(weather_url)
+    w_res.raise_for_status()
+    weather = w_res.json()
+
+    pollution_url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lng}&appid={OPENWEATHER_API_KEY}"
+    p_res = await client.get(pollution_url)
+    p_res.raise_for_status()
+    pollution = p_res.json()['list'][0]['components']
+
+    store_live_inputs(key, weather, pollution)
+    return weather, pollution
+
+def store_live_inputs(key, weather, pollution):
+    now = time.monotonic()
+    live_cache[key] = (now, weather, pollution)
+    live_cache.move_to_end(key)
+    # Evict expired entries from the least-recently-used end, then trim anything past the size cap
+    while live_cache and (now - next(iter(live_cache.values()))[0] >= LIVE_CACHE_TTL_SECONDS or len(live_cache) > LIVE_CACHE_MAX_ENTRIES):
+        live_cache.popitem(last=False)
+
+def build_features(weather, pollution):
+    return [
+        pollution.get('co', 200), pollution.get('no', 1), pollution.get('no2', 10),
+        pollution.get('o3', 50), pollution.get('so2', 2), pollution.get('pm2_5', 25),
+        pollution.get('pm10', 50), pollution.get('nh3', 5), weather['main'].get('temp', 25),
+        weather['main'].get('humidity', 60), weather['wind'].get('speed', 3), 
+        weather.get('visibility', 10000)
+    ]
+
+def find_nearest_stations(lat, lng, k):
+    """Return (distances_km, station_rows) for the k stations closest to a coordinate"""
+    k = max(1, min(k, len(stations)))
+    dist, idx = station_tree.query(np.radians([[lat, lng]]), k=k)
+    return dist[0] * EARTH_RADIUS_KM, stations.iloc[idx[0]]
+
+def idw_weights(distances_km, power=2):
+    """Inverse-distance weights; an exact station hit takes all the weight"""
+    distances_km = np.asarray(distances_km, dtype=float)
+    if np.any(distances_km < 1e-6):
+        return (distances_km < 1e-6).astype(float) / np.count_nonzero(distances_km < 1e-6)
+    w = 1.0 / distances_km ** power
+    return w / w.sum()
+
 @app.post("/predict-city")
 async def predict_aqi_from_city(city_data: CityData):
+    started = time.perf_counter()
     if model is None: raise HTTPException(status_code=503, detail="ML model is not available.")
     if not OPENWEATHER_API_KEY or "YOUR" in OPENWEATHER_API_KEY:
         raise HTTPException(status_code=500, detail="OpenWeatherMap API key is not configured on the server.")
 
     async with httpx.AsyncClient() as client:
         try:
-            weather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={city_data.lat}&lon={city_data.lng}&appid={OPENWEATHER_API_KEY}&units=metric"
-            w_res = await client.get(weather_url)
-            w_res.raise_for_status()
-            weather = w_res.json()
-
-            pollution_url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={city_data.lat}&lon={city_data.lng}&appid={OPENWEATHER_API_KEY}"
-            p_res = await client.get(pollution_url)
-            p_res.raise_for_status()
-            pollution = p_res.json()['list'][0]['components']
+            weather, pollution = await fetch_live_inputs(client, city_data.lat, city_data.lng)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error fetching live data from API: {e}")
 
-    features = [[
-        pollution.get('co', 200), pollution.get('no', 1), pollution.get('no2', 10),
-        pollution.get('o3', 50), pollution.get('so2', 2), pollution.get('pm2_5', 25),
-        pollution.get('pm10', 50), pollution.get('nh3', 5), weather['main'].get('temp', 25),
-        weather['main'].get('humidity', 60), weather['wind'].get('speed', 3), 
-        weather.get('visibility', 10000)
-    ]]
+    features = [build_features(weather, pollution)]
     
     predicted_aqi_value = int(model.predict(features)[0])
+    log_prediction('predict-city', city_data.lat, city_data.lng, features[0], predicted_aqi_value, (time.perf_counter() - started) * 1000)
     
     live_data = {
         "weather": {"temp": round(weather['main'].get('temp',0)), "humidity": weather['main'].get('humidity',0), "wind_speed": round(weather['wind'].get('speed',0)*3.6,1), "visibility": round(weather.get('visibility',0)/1000,1)},
@@ -654,6 +877,45 @@ async def predict_aqi_from_city(city_data: CityData):
     }
     return {"predicted_aqi": predicted_aqi_value, "live_data": live_data}
 
+@app.post("/predict-location")
+async def predict_aqi_from_location(location: LocationData):
+    started = time.perf_counter()
+    if model is None: raise HTTPException(status_code=503, detail="ML model is not available.")
+    if station_tree is None: raise HTTPException(status_code=404, detail="Station index not available, dataset not loaded.")
+    if not OPENWEATHER_API_KEY or "YOUR" in OPENWEATHER_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenWeatherMap API key is not configured on the server.")
+
+    distances_km, nearest = find_nearest_stations(location.lat, location.lng, location.k)
+    # Neighbours beyond the radius say nothing useful about this location
+    in_range = distances_km <= MAX_STATION_DISTANCE_KM
+    if not in_range.any():
+        raise HTTPException(status_code=404, detail=f"No monitoring station within {MAX_STATION_DISTANCE_KM:.0f} km of this location.")
+    distances_km, nearest = distances_km[in_range], nearest[in_range]
+
+    # Live inputs come from the nearest stations (cached), not from the raw query coordinate
+    async with httpx.AsyncClient() as client:
+        try:
+            station_inputs = await asyncio.gather(*(fetch_live_inputs(client, s['lat'], s['lng']) for _, s in nearest.iterrows()))
+            station_features = [build_features(weather, pollution) for weather, pollution in station_inputs]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching live data from API: {e}")
+
+    weights = idw_weights(distances_km)
+    f = np.average(np.asarray(station_features, dtype=float), axis=0, weights=weights).tolist()
+
+    predicted_aqi_value = int(model.predict([f])[0])
+    log_prediction('predict-location', location.lat, location.lng, f, predicted_aqi_value, (time.perf_counter() - started) * 1000)
+
+    live_data = {
+        "weather": {"temp": round(f[8]), "humidity": round(f[9]), "wind_speed": round(f[10]*3.6,1), "visibility": round(f[11]/1000,1)},
+        "pollution": {"co": round(f[0],2), "no2": round(f[2],2), "o3": round(f[3],2), "pm2_5": round(f[5],2)}
+    }
+    nearest_stations = [
+        {'city': s['City'], 'state': s['State'], 'lat': float(s['lat']), 'lng': float(s['lng']), 'distance_km': round(float(d), 2), 'weight': round(float(w), 4)}
+        for (_, s), d, w in zip(nearest.iterrows(), distances_km, weights)
+    ]
+    return {"predicted_aqi": predicted_aqi_value, "live_data": live_data, "nearest_stations": nearest_stations}
+
 @app.get("/api/dataset-stats")
 async def get_dataset_stats():
     if df is None: return {"total_records": "N/A", "cities_count": "N/A", "states_count": "N/A", "most_common_aqi": "N/A"}
@@ -704,6 +966,53 @@ async def get_visualizations():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating visualizations: {e}")
 
+@app.get("/api/timeseries")
+async def get_timeseries(city: str = None, state: str = None, metric: str = 'AQI', start: str = None, end: str = None, width: int = 500):
+    """AQI/pollutant series for one city or state, limited to [start, end] and downsampled to about `width` points"""
+    if timeseries_index is None: raise HTTPException(status_code=404, detail="Time-series index not available, dataset not loaded.")
+    if city is not None:
+        # 'state' narrows the city when the same name exists in more than one state
+        matches = [key for key in timeseries_index['city'] if key[0] == city and (state is None or key[1] == state)]
+        if not matches:
+            raise HTTPException(status_code=404, detail=f"No data for city '{city}'" + (f" in state '{state}'." if state else "."))
+        if len(matches) > 1:
+            raise HTTPException(status_code=422, detail=f"City '{city}' exists in several states, pass 'state' as one of: {sorted(k[1] for k in matches)}")
+        level, name = 'city', matches[0]
+    elif state is not None:
+        if state not in timeseries_index['state']:
+            raise HTTPException(status_code=404, detail=f"No data for state '{state}'.")
+        level, name = 'state', state
+    else:
+        raise HTTPException(status_code=422, detail="Provide 'city' (optionally with 'state') or 'state'.")
+    t, series = timeseries_index[level][name]
+    if metric not in series:
+        raise HTTPException(status_code=422, detail=f"Unknown metric '{metric}'. Choose from: {list(series)}")
+    try:
+        start_s = None if start is None else parse_timeseries_bound(start)
+        end_s = None if end is None else parse_timeseries_bound(end)
+        if start_s is not None and end_s is not None and start_s > end_s:
+            raise HTTPException(status_code=422, detail="'start' must not be after 'end'.")
+        lo = 0 if start_s is None else int(np.searchsorted(t, start_s, side='left'))
+        hi = len(t) if end_s is None else int(np.searchsorted(t, end_s, side='right'))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid start/end timestamp: {e}")
+    width = max(10, min(width, TIMESERIES_MAX_WIDTH))
+
+    x, y = t[lo:hi], series[metric][lo:hi]
+    finite = np.isfinite(y)
+    x, y = x[finite], y[finite]
+    total_points = len(x)
+    x, y = lttb(x, y, width)
+    return {
+        'city': name[0] if level == 'city' else None,
+        'state': name[1] if level == 'city' else name,
+        'metric': metric,
+        'total_points': total_points,
+        'returned_points': len(x),
+        'x': np.datetime_as_string(x.astype('datetime64[s]'), unit='m').tolist(),
+        'y': np.round(y, 2).tolist(),
+    }
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=7860)
 
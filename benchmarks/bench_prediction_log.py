@@ -0,0 +1,103 @@
+"""Benchmark the prediction log's overhead on /predict-city request latency.
+
+Calls the handler in-process with the upstream client and the model stubbed, first with
+log_prediction disabled and then enabled while the background writer flushes to a temporary
+SQLite file. An optional simulated upstream delay puts the overhead next to a realistic request.
+With no delay the loop barely idles between flushes, so the buffer overflows and drops oldest records.
+
+    python benchmarks/bench_prediction_log.py --requests 5000 --trials 5 --upstream-ms 1
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+WEATHER = {'main': {'temp': 30, 'humidity': 50}, 'wind': {'speed': 2}, 'visibility': 8000}
+POLLUTION = {'co': 230.0, 'no2': 2.6, 'o3': 33.6, 'pm2_5': 6.3, 'pm10': 11.5}
+
+
+class StubModel:
+    def predict(self, X):
+        return [3]
+
+
+class StubClient:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+async def run(n, upstream_ms):
+    city = app.CityData(city='Mumbai', state='Maharashtra', lat=19.076, lng=72.8777)
+    latencies = np.empty(n)
+    for i in range(n):
+        t0 = time.perf_counter()
+        await app.predict_aqi_from_city(city)
+        latencies[i] = time.perf_counter() - t0
+        if upstream_ms:
+            await asyncio.sleep(upstream_ms / 1000)
+        elif i % 100 == 0:
+            await asyncio.sleep(0)  # give the writer task a chance to run
+    return latencies * 1e6
+
+
+def report(name, trials):
+    p50 = np.median([np.percentile(t, 50) for t in trials])
+    p99 = np.median([np.percentile(t, 99) for t in trials])
+    print(f"{name:>9}: p50={p50:8.1f} us  p99={p99:8.1f} us  (median of {len(trials)} trials)")
+    return p99
+
+
+async def main(args):
+    async def fetch(client, lat, lng):
+        if args.upstream_ms:
+            await asyncio.sleep(args.upstream_ms / 1000)
+        return WEATHER, POLLUTION
+
+    app.model, app.model_version = StubModel(), 'bench'
+    app.fetch_live_inputs = fetch
+    app.httpx.AsyncClient = StubClient
+    app.PREDICTION_LOG_FLUSH_SECONDS = args.flush_seconds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.PREDICTION_LOG_DB = os.path.join(tmp, 'prediction_log.db')
+        await app.start_prediction_log()
+
+        # Alternate baseline and logged phases so drift and scheduler noise hit both equally
+        log_prediction, disabled = app.log_prediction, (lambda *a: None)
+        app.log_prediction = disabled
+        await run(min(1000, args.requests), args.upstream_ms)  # warm-up
+        baseline, logged = [], []
+        for _ in range(args.trials):
+            app.log_prediction = disabled
+            baseline.append(await run(args.requests, args.upstream_ms))
+            app.log_prediction = log_prediction
+            logged.append(await run(args.requests, args.upstream_ms))
+
+        await app.stop_prediction_log()
+        with contextlib.closing(sqlite3.connect(app.PREDICTION_LOG_DB)) as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    baseline_p99 = report('no log', baseline)
+    overhead = report('with log', logged) - baseline_p99
+    print(f"p99 overhead: {overhead:+.1f} us; {rows:,} rows persisted, {app.prediction_log_dropped} dropped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5_000, help="requests per phase")
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--upstream-ms', type=float, default=0.0, help="simulated OpenWeather round-trip per request")
+    parser.add_argument('--flush-seconds', type=float, default=app.PREDICTION_LOG_FLUSH_SECONDS)
+    asyncio.run(main(parser.parse_args()))
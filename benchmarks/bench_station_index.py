@@ -0,0 +1,64 @@
+"""Benchmark the /predict-location station lookup (BallTree.query) with millions of random query points.
+
+Runs in-process with no upstream calls. Uses india_air_quality_data.csv when present,
+otherwise a synthetic set of stations spread over India.
+
+    python benchmarks/bench_station_index.py --queries 2000000 --k 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def load_stations(n_synthetic, rng):
+    if os.path.exists('india_air_quality_data.csv'):
+        return pd.read_csv('india_air_quality_data.csv', usecols=lambda c: c.strip() in ('City', 'State', 'lat', 'lng'))
+    return pd.DataFrame({
+        'City': [f'City{i}' for i in range(n_synthetic)], 'State': 'Synthetic',
+        'lat': rng.uniform(8, 35, n_synthetic), 'lng': rng.uniform(68, 97, n_synthetic),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=2_000_000)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--stations', type=int, default=500, help="synthetic station count when the CSV is absent")
+    parser.add_argument('--single', type=int, default=20_000, help="queries timed one at a time through find_nearest_stations")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    t0 = time.perf_counter()
+    app.station_tree, app.stations = app.build_station_index(load_stations(args.stations, rng))
+    print(f"index: {len(app.stations)} stations built in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    queries = np.column_stack([rng.uniform(-90, 90, args.queries), rng.uniform(-180, 180, args.queries)])
+    t0 = time.perf_counter()
+    _, idx = app.station_tree.query(np.radians(queries), k=args.k)
+    elapsed = time.perf_counter() - t0
+    print(f"batch:  {args.queries:,} queries (k={args.k}) in {elapsed:.2f} s, {elapsed / args.queries * 1e6:.2f} us/query")
+
+    latencies = np.empty(args.single)
+    for i, (lat, lng) in enumerate(queries[:args.single]):
+        t0 = time.perf_counter()
+        app.find_nearest_stations(lat, lng, args.k)
+        latencies[i] = time.perf_counter() - t0
+    latencies *= 1e6
+    print(f"single: {args.single:,} queries p50={np.percentile(latencies, 50):.1f} us p99={np.percentile(latencies, 99):.1f} us")
+
+    # Spot-check against a brute-force haversine scan
+    coords = np.radians(app.stations[['lat', 'lng']].to_numpy(dtype=float))
+    q = np.radians(queries[:1000])
+    a = np.sin((coords[None, :, 0] - q[:, None, 0]) / 2) ** 2 + np.cos(q[:, None, 0]) * np.cos(coords[None, :, 0]) * np.sin((coords[None, :, 1] - q[:, None, 1]) / 2) ** 2
+    print(f"check:  nearest station matches brute force for {np.mean(a.argmin(axis=1) == idx[:1000, 0]):.1%} of 1,000 samples")
+
+
+if __name__ == '__main__':
+    main()